@@ -3,128 +3,157 @@
 import os
 import logging
 import numpy as np # Import numpy
-from typing import Tuple, List, Dict
+from typing import Tuple, List, Optional
+import connectorx as cx
 import pandas as pd
-from sqlalchemy import create_engine, select, func
-from sqlalchemy.orm import sessionmaker
+from scipy.special import expit
+from sqlalchemy import and_, create_engine, select, func
+from sqlalchemy.engine import Dialect, Engine
+from sqlalchemy.sql import Select
 
 from app.models import User, Skill, UserSkill, Task, TaskRequiredSkill
 
+# --- Shared Database Engine ---
+_DB_ENGINE: Optional[Engine] = None
+
+def get_db_engine() -> Engine:
+    """
+    Returns the process-wide pooled SQLAlchemy engine, creating it on first use so
+    model refreshes and health checks reuse connections instead of reconnecting.
+    """
+    global _DB_ENGINE
+    if _DB_ENGINE is None:
+        db_url = os.getenv("DATABASE_URL")
+        if not db_url:
+            logging.error("DATABASE_URL environment variable not set.")
+            raise ValueError("DATABASE_URL is not configured.")
+
+        _DB_ENGINE = create_engine(
+            db_url, pool_size=5, max_overflow=5, pool_pre_ping=True, pool_use_lifo=True, pool_recycle=1800
+        )
+    return _DB_ENGINE
+
 # --- Sigmoid Function for Dynamic Weighting ---
-def get_implicit_weight(task_count: float, k: float = 0.5, midpoint: float = 10.0) -> float:
+def get_implicit_weight(task_count: np.ndarray, k: float = 0.5, midpoint: float = 10.0) -> np.ndarray:
     """
-    Calculates the weight for implicit ratings using a sigmoid function.
+    Calculates the weights for implicit ratings using a sigmoid function.
     
     Args:
-        task_count: The number of tasks a user has completed.
+        task_count: The number of tasks each user has completed.
         k: The steepness of the curve.
         midpoint: The number of tasks where weight is 0.5.
 
     Returns:
-        A weight between 0 and 1.
+        An array of weights between 0 and 1.
     """
-    if task_count == 0:
-        return 0.0 # A user with zero completed tasks has 0% weight on implicit skills.
-    return 1 / (1 + np.exp(-k * (task_count - midpoint)))
+    tc = np.asarray(task_count, dtype=np.float32)
+    weights = expit(k * (tc - midpoint))
+    weights[tc == 0] = 0.0 # A user with zero completed tasks has 0% weight on implicit skills.
+    return weights
 
 
-def load_data_for_engine() -> Tuple[pd.DataFrame, List[int], Dict[Tuple[int, int], float]]:
+def compile_query(query: Select, dialect: Dialect) -> str:
     """
-    Fetches and processes data using a dynamic weighting system for ratings.
+    Renders a SQLAlchemy query as a plain SQL string that connectorx can execute.
     """
-    db_url = os.getenv("DATABASE_URL")
-    if not db_url:
-        logging.error("DATABASE_URL environment variable not set.")
-        raise ValueError("DATABASE_URL is not configured.")
+    return str(query.compile(dialect=dialect, compile_kwargs={"literal_binds": True}))
 
-    engine = create_engine(db_url)
-    SessionLocal = sessionmaker(bind=engine)
-    session = SessionLocal()
+
+def load_data_for_engine() -> Tuple[pd.DataFrame, List[int]]:
+    """
+    Fetches and processes data using a dynamic weighting system for ratings.
+    """
+    # SQLAlchemy only builds and compiles the queries; connectorx runs them over its own
+    # connections and writes the results straight into columnar DataFrame buffers.
+    engine = get_db_engine()
+    cx_url = engine.url.set(drivername=engine.url.get_backend_name()).render_as_string(hide_password=False)
 
     try:
         # --- Part 1: Fetch Raw Data ---
-        
-        # 1a. Fetch Explicit Ratings (unchanged)
-        logging.info("Fetching explicit ratings...")
-        proficiency_query = select(UserSkill.user_id, UserSkill.skill_id, UserSkill.proficiency)
-        explicit_df = pd.read_sql(proficiency_query, session.bind)
-        proficiency_map = {'beginner': 2.0, 'intermediate': 3.5, 'expert': 5.0}
-        explicit_df['explicit_rating'] = explicit_df['proficiency'].map(proficiency_map) #type: ignore
-        
-        # 1b. Fetch Implicit Ratings (unchanged)
-        logging.info("Fetching implicit ratings...")
-        completed_tasks_query = select(Task.assignee_id.label('user_id'), TaskRequiredSkill.skill_id) \
-            .join(TaskRequiredSkill, Task.id == TaskRequiredSkill.task_id) \
-            .where(Task.status == 'done', Task.assignee_id.isnot(None))
-        implicit_df = pd.read_sql(completed_tasks_query, session.bind)
-        # We value completion highly, but we also group to get a raw count of experience
-        implicit_df = implicit_df.groupby(['user_id', 'skill_id']).size().reset_index(name='implicit_strength') #type: ignore
-        implicit_df['implicit_rating'] = 5.0 # A completed task always implies high proficiency
-        logging.info(f"Found {len(implicit_df)} implicit user-skill experiences.")
-
-        # 1c. NEW: Fetch total completed task count per user (our 'experience' metric)
-        logging.info("Fetching user experience (total completed tasks)...")
-        experience_query = select(Task.assignee_id.label('user_id'), func.count(Task.id).label('task_count')) \
-            .where(Task.status == 'done', Task.assignee_id.isnot(None)) \
-            .group_by(Task.assignee_id)
-        experience_df = pd.read_sql(experience_query, session.bind)
-        logging.info(f"Calculated experience for {len(experience_df)} users.")
-
-        # --- Part 2: Combine and Apply Dynamic Weighting ---
-        
-        # 2a. Merge explicit and implicit ratings into a single DataFrame
-        ratings_df = pd.merge(
-            explicit_df[['user_id', 'skill_id', 'explicit_rating']],
-            implicit_df[['user_id', 'skill_id', 'implicit_rating']],
-            on=['user_id', 'skill_id'],
-            how='outer'
-        )
-
-        # 2b. Merge in the user's total experience
-        ratings_df = pd.merge(ratings_df, experience_df, on='user_id', how='left')
-        ratings_df['task_count'] = ratings_df['task_count'].fillna(0) # Users with no tasks get 0
+        # Joins and aggregations run server-side so all rating inputs arrive in one round-trip.
 
-        # 2c. Apply the dynamic weighting logic
-        def calculate_dynamic_rating(row):
-            task_count = row['task_count']
-            explicit_rating = row['explicit_rating'] if pd.notna(row['explicit_rating']) else 0
-            implicit_rating = row['implicit_rating'] if pd.notna(row['implicit_rating']) else 0
+        # 1a. Explicit ratings: the proficiency each user claims for a skill
+        explicit_cte = select(UserSkill.user_id, UserSkill.skill_id, UserSkill.proficiency).cte('explicit')
 
-            # If a user only has one type of rating, use that.
-            if explicit_rating == 0: return implicit_rating
-            if implicit_rating == 0: return explicit_rating
-
-            # If both exist, apply dynamic weighting
-            implicit_weight = get_implicit_weight(task_count)
-            explicit_weight = 1.0 - implicit_weight
-            
-            return (explicit_weight * explicit_rating) + (implicit_weight * implicit_rating)
+        # 1b. Implicit ratings: how many completed tasks exercised each user-skill pair
+        implicit_cte = select(
+                Task.assignee_id.label('user_id'),
+                TaskRequiredSkill.skill_id,
+                func.count().label('implicit_strength')
+            ) \
+            .join(TaskRequiredSkill, Task.id == TaskRequiredSkill.task_id) \
+            .where(Task.status == 'done', Task.assignee_id.isnot(None)) \
+            .group_by(Task.assignee_id, TaskRequiredSkill.skill_id) \
+            .cte('implicit')
 
+        # 1c. Total completed task count per user (our 'experience' metric)
+        experience_cte = select(Task.assignee_id.label('user_id'), func.count(Task.id).label('task_count')) \
+            .where(Task.status == 'done', Task.assignee_id.isnot(None)) \
+            .group_by(Task.assignee_id) \
+            .cte('experience')
+
+        # 1d. Full outer join explicit and implicit ratings, then attach each user's experience
+        user_id = func.coalesce(explicit_cte.c.user_id, implicit_cte.c.user_id)
+        ratings_query = select(
+                user_id.label('user_id'),
+                func.coalesce(explicit_cte.c.skill_id, implicit_cte.c.skill_id).label('skill_id'),
+                explicit_cte.c.proficiency,
+                implicit_cte.c.implicit_strength,
+                func.coalesce(experience_cte.c.task_count, 0).label('task_count') # Users with no tasks get 0
+            ) \
+            .select_from(
+                explicit_cte.join(
+                    implicit_cte,
+                    and_(explicit_cte.c.user_id == implicit_cte.c.user_id, explicit_cte.c.skill_id == implicit_cte.c.skill_id),
+                    full=True
+                ).outerjoin(experience_cte, experience_cte.c.user_id == user_id)
+            )
+
+        logging.info("Fetching explicit and implicit ratings...")
+        # Not partitioned: Postgres can't push a user_id range below the full outer join,
+        # so each partition would re-run the whole join and aggregation
+        ratings_df = cx.read_sql(cx_url, compile_query(ratings_query, engine.dialect), return_type="pandas")
+        logging.info(f"Fetched {len(ratings_df)} user-skill pairs.")
+
+        # --- Part 2: Decode and Apply Dynamic Weighting ---
+
+        # 2a. Explicit proficiency levels map to fixed ratings. Decoding via categorical codes
+        # turns per-row string hashing into a single array gather; the trailing NaN is picked
+        # up by code -1, i.e. pairs with no explicit rating.
+        proficiency_levels = pd.Categorical(ratings_df['proficiency'], categories=['beginner', 'intermediate', 'expert'])
+        proficiency_ratings = np.array([2.0, 3.5, 5.0, np.nan], dtype=np.float32)
+        ratings_df['explicit_rating'] = proficiency_ratings[proficiency_levels.codes]
+
+        # 2b. A completed task always implies high proficiency
+        ratings_df['implicit_rating'] = np.where(ratings_df['implicit_strength'].notna(), 5.0, np.nan).astype(np.float32)
+
+        # 2c. Apply the dynamic weighting logic (vectorized over the whole frame)
         logging.info("Applying dynamic weighting to calculate final ratings...")
-        ratings_df['rating'] = ratings_df.apply(calculate_dynamic_rating, axis=1)
+        explicit = ratings_df['explicit_rating'].fillna(0).to_numpy(dtype=np.float32)
+        implicit = ratings_df['implicit_rating'].fillna(0).to_numpy(dtype=np.float32)
+        implicit_weight = get_implicit_weight(ratings_df['task_count'].to_numpy())
+        blended = (1.0 - implicit_weight) * explicit + implicit_weight * implicit
+
+        # If a user only has one type of rating, use that.
+        ratings_df['rating'] = np.where(explicit == 0, implicit, np.where(implicit == 0, explicit, blended))
         
         # Final DataFrame for the engine
         final_ratings_df = ratings_df[['user_id', 'skill_id', 'rating']].copy()
         final_ratings_df.dropna(inplace=True) # Ensure no NaN ratings
+        # Pin dtypes so merges/fillna upcasts don't leak float64 into the engine
+        final_ratings_df = final_ratings_df.astype({'user_id': 'int64', 'skill_id': 'int64', 'rating': 'float32'})
         logging.info(f"Generated {len(final_ratings_df)} dynamically weighted ratings.")
 
-        # --- Part 3: Load Available Users and Create Map (Unchanged) ---
-        
-        actual_ratings_map = {
-            (row.user_id, row.skill_id): row.rating # type: ignore
-            for row in final_ratings_df.itertuples()
-        }
+        # --- Part 3: Load Available Users ---
 
         logging.info("--- Loading Available Users ---")
         available_users_query = select(User.id).where(User.availability == 'available')
-        available_users_df = pd.read_sql(available_users_query, session.bind)
+        available_users_df = cx.read_sql(cx_url, compile_query(available_users_query, engine.dialect), return_type="pandas")
         available_user_ids = available_users_df['id'].tolist()
         logging.info(f"Found {len(available_user_ids)} available users.")
 
-        return final_ratings_df, available_user_ids, actual_ratings_map
+        return final_ratings_df, available_user_ids
 
     except Exception as e:
         logging.error(f"Failed to load data from database: {e}", exc_info=True)
-        return pd.DataFrame(), [], {}
-    finally:
-        session.close()
+        return pd.DataFrame(), []
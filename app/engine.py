@@ -1,13 +1,132 @@
 # app/engine.py
 
 import logging
-from typing import List, Dict, Any, Set
-from collections import defaultdict
+from typing import List, Dict, Any, NamedTuple, Optional, Set
 
-from surprise import Dataset, Reader, SVD
+import numpy as np
+import pandas as pd
+from numba import njit
 
 from .data_loader import load_data_for_engine
 
+
+def skill_bit(skill_idx: np.ndarray) -> np.ndarray:
+    """
+    Returns the bit that represents each skill within its uint64 lane.
+    """
+    return np.left_shift(np.uint64(1), (skill_idx % 64).astype(np.uint64))
+
+
+def id_lookup_table(ids: np.ndarray) -> np.ndarray:
+    """
+    Builds a dense raw id -> compact index table; ids not in `ids` map to -1.
+    """
+    table = np.full(int(ids.max()) + 1, -1, dtype=np.int32)
+    table[ids] = np.arange(len(ids), dtype=np.int32)
+    return table
+
+
+def lookup_idx(table: np.ndarray, ids) -> np.ndarray:
+    """
+    Maps raw ids to compact indices through `table`, dropping ids it doesn't know.
+    """
+    # Range-check while still Python ints, so ids beyond int64 can't overflow the conversion
+    ids = np.asarray([i for i in ids if 0 <= i < len(table)], dtype=np.int64)
+    idx = table[ids]
+    return idx[idx >= 0].astype(np.intp)
+
+
+# Channels of the (user x skill x 2) feature array scored by `score_candidates`
+RATING, AFFINITY = 0, 1
+
+
+@njit(fastmath=True, nogil=True)
+def ridge_normal_equations(rows, cols, values, fixed_factors, n_rows, reg):
+    """
+    Builds one ALS half-step's regularized least-squares system for every row, using only
+    that row's observed cells: (sum of y y^T + reg * I) x = sum of value * y, where y are
+    the fixed side's factors.
+    """
+    k = fixed_factors.shape[1]
+    gram = np.zeros((n_rows, k, k))
+    rhs = np.zeros((n_rows, k))
+    for r in range(n_rows):
+        for a in range(k):
+            gram[r, a, a] = reg
+    for i in range(rows.shape[0]):
+        r = rows[i]
+        y = fixed_factors[cols[i]]
+        for a in range(k):
+            rhs[r, a] += values[i] * y[a]
+            for b in range(k):
+                gram[r, a, b] += y[a] * y[b]
+    return gram, rhs
+
+
+def fit_als_factors(rating_users, rating_skills, residuals, n_users, n_skills, n_factors, reg, n_iters):
+    """
+    Fits user and skill factors to the observed residuals by alternating ridge regressions.
+    Unobserved cells are left out of the loss rather than treated as zeros, and `reg`
+    keeps the factors at 0 unless the residuals share real latent structure.
+    """
+    rng = np.random.default_rng(42)
+    user_factors = rng.normal(0, 0.1, (n_users, n_factors))
+    skill_factors = rng.normal(0, 0.1, (n_skills, n_factors))
+    if n_factors == 0:
+        # Too few skills to factorize; affinity falls back to the biases alone
+        return user_factors, skill_factors
+    for _ in range(n_iters):
+        gram, rhs = ridge_normal_equations(rating_users, rating_skills, residuals, skill_factors, n_users, reg)
+        user_factors = np.linalg.solve(gram, rhs[:, :, None])[:, :, 0]
+        gram, rhs = ridge_normal_equations(rating_skills, rating_users, residuals, user_factors, n_skills, reg)
+        skill_factors = np.linalg.solve(gram, rhs[:, :, None])[:, :, 0]
+    return user_factors, skill_factors
+
+
+class ScoringState(NamedTuple):
+    """
+    Everything `get_recommendations` reads, built by a refresh and published as one unit.
+    """
+    user_ids: np.ndarray            # Compact user index -> raw user id
+    skill_id_to_idx: np.ndarray     # Raw skill id -> compact skill index (-1 if unknown)
+    skill_features: np.ndarray      # (user x skill x 2) rating / affinity cells
+    unknown_skill_pred: np.ndarray  # Per-user affinity for skills nobody has rated
+    user_bits: np.ndarray           # (user x lane) uint64 skill bitsets
+    available_idx: np.ndarray       # Compact indices of available users
+
+
+@njit(fastmath=True, nogil=True)
+def score_candidates(user_idx, skill_idx, n_required, skill_features, unknown_skill_pred, w_coverage, w_proficiency, w_affinity,
+                     coverage, proficiency, affinity, score):
+    """
+    Fused coverage + proficiency + affinity scoring for each user in `user_idx`,
+    in a single pass over the required skill columns. Results are written into
+    the four output arrays.
+    """
+    n_unknown = n_required - skill_idx.shape[0]
+    for i in range(user_idx.shape[0]):
+        u = user_idx[i]
+        matched = 0
+        proficiency_sum = 0.0
+        affinity_sum = n_unknown * unknown_skill_pred[u]
+        for j in range(skill_idx.shape[0]):
+            s = skill_idx[j]
+            affinity_sum += skill_features[u, s, AFFINITY]
+            rating = skill_features[u, s, RATING]
+            if rating > 0:
+                matched += 1
+                proficiency_sum += rating
+
+        coverage[i] = matched / n_required
+        proficiency[i] = proficiency_sum / matched if matched > 0 else 0.0
+        affinity[i] = affinity_sum / n_required
+        score[i] = (
+            (w_coverage * coverage[i]) +
+            (w_proficiency * (proficiency[i] / 5.0)) + # Normalize to 0-1 scale
+            (w_affinity * (affinity[i] / 5.0))   # Normalize to 0-1 scale
+        )
+
+
 class RecommendationEngine:
     """
     Implements a multi-stage hybrid recommendation system.
@@ -22,94 +141,165 @@ class RecommendationEngine:
     WEIGHT_PROFICIENCY = 0.3 # Priority 2: How good are they at the skills they have?
     WEIGHT_AFFINITY = 0.1    # Priority 3: Do they have latent talent for this work?
 
+    # --- AFFINITY MODEL ---
+    N_FACTORS = 10      # Latent factors per user/skill, also capped at a quarter of the skill count
+    FACTOR_REG = 5.0    # Ridge penalty that keeps factors near 0 unless the ratings support them
+    ALS_ITERATIONS = 15
+    USER_BIAS_REG = 15  # Shrink user/skill biases toward 0 when they have few ratings
+    SKILL_BIAS_REG = 10
+
     def __init__(self):
         logging.info("Initializing RecommendationEngine...")
+        self.state: Optional[ScoringState] = None
         self.refresh_model() # Initial training on startup
 
+    @property
+    def is_ready(self) -> bool:
+        return self.state is not None
+
     def refresh_model(self):
         logging.info("Refreshing the recommendation model...")
         # The data loader now provides the dynamically weighted ratings
-        self.ratings_df, self.available_user_ids, self.actual_ratings_map = load_data_for_engine()
+        ratings_df, available_user_ids = load_data_for_engine()
 
-        if self.ratings_df.empty:
+        if ratings_df.empty:
             logging.error("Ratings data is empty. Model cannot be trained.")
-            self.model = None
+            self.state = None
             return
 
-        # Initialize and train the SVD model for the Collaborative Affinity score
-        reader = Reader(rating_scale=(1, 5))
-        data = Dataset.load_from_df(self.ratings_df[['user_id', 'skill_id', 'rating']], reader)
-        trainset = data.build_full_trainset()
+        # Everything below is built in locals and published as one snapshot at the end, so
+        # requests scoring concurrently on worker threads never see a half-refreshed model
+
+        # Structure-of-arrays view of the ratings, remapped to compact internal ids
+        user_codes, user_ids = pd.factorize(ratings_df['user_id'].to_numpy(), sort=True)
+        skill_codes, skill_ids = pd.factorize(ratings_df['skill_id'].to_numpy(), sort=True)
+        rating_users = np.ascontiguousarray(user_codes, dtype=np.int64)
+        rating_skills = np.ascontiguousarray(skill_codes, dtype=np.int64)
+        rating_values = np.ascontiguousarray(ratings_df['rating'].to_numpy(), dtype=np.float32)
+
+        user_id_to_idx = id_lookup_table(user_ids)
+        skill_id_to_idx = id_lookup_table(skill_ids)
+
+        # Dense (user x skill) features for scoring, with a cell's rating and affinity estimate
+        # interleaved so the kernel reads both from one cache line. Real ratings are always
+        # positive, so a rating of 0 marks a skill the user doesn't have.
+        n_users, n_skills = len(user_ids), len(skill_ids)
+        skill_features = np.zeros((n_users, n_skills, 2), dtype=np.float32)
+        skill_features[rating_users, rating_skills, RATING] = rating_values
+
+        # Per-user skill bitsets packed into uint64 lanes for fast candidate filtering
+        n_lanes = (n_skills + 63) // 64
+        user_bits = np.zeros((n_users, n_lanes), dtype=np.uint64)
+        np.bitwise_or.at(user_bits, (rating_users, rating_skills // 64), skill_bit(rating_skills))
+
+        # Train the biased matrix factorization for the Collaborative Affinity score: damped
+        # user/skill biases around the global mean, plus low-rank factors fitted by ALS to the
+        # residuals of the observed ratings only
+        global_mean = rating_values.mean(dtype=np.float64)
+        deviations = rating_values - global_mean
+        user_bias = np.bincount(rating_users, weights=deviations, minlength=n_users) \
+            / (np.bincount(rating_users, minlength=n_users) + self.USER_BIAS_REG)
+        deviations -= user_bias[rating_users]
+        skill_bias = np.bincount(rating_skills, weights=deviations, minlength=n_skills) \
+            / (np.bincount(rating_skills, minlength=n_skills) + self.SKILL_BIAS_REG)
+        deviations -= skill_bias[rating_skills]
+
+        # Keep the rank well below the skill dimension so the factors learn shared structure
+        # instead of reproducing each user's own ratings
+        n_factors = min(self.N_FACTORS, n_skills // 4)
+        user_factors, skill_factors = fit_als_factors(
+            rating_users, rating_skills, deviations.astype(np.float64), n_users, n_skills,
+            n_factors, self.FACTOR_REG, self.ALS_ITERATIONS
+        )
+
+        # The model is static between refreshes, so cache every (user, skill) estimate up front
+        user_baseline = global_mean + user_bias
+        skill_features[:, :, AFFINITY] = np.clip(
+            user_baseline[:, None] + skill_bias[None, :] + user_factors @ skill_factors.T,
+            1, 5
+        )
+        # A skill nobody has rated has no bias or factors, so its estimate is the user's baseline alone
+        unknown_skill_pred = np.clip(user_baseline, 1, 5).astype(np.float32)
+
+        # Available users who have at least one rated skill (others can never be candidates)
+        available_idx = lookup_idx(user_id_to_idx, available_user_ids)
 
-        self.model = SVD(n_factors=50, n_epochs=20, random_state=42)
-        self.model.fit(trainset)
+        # JIT-compile the scoring kernel for these array types now rather than on the first request
+        no_users, no_scores = available_idx[:0], np.empty(0)
+        score_candidates(
+            no_users, no_users, 1, skill_features, unknown_skill_pred,
+            self.WEIGHT_COVERAGE, self.WEIGHT_PROFICIENCY, self.WEIGHT_AFFINITY,
+            no_scores, no_scores, no_scores, no_scores
+        )
 
-        # Create a fast lookup map for user's skills
-        self.user_skills_map = defaultdict(set)
-        for user_id, skill_id in self.actual_ratings_map.keys():
-            self.user_skills_map[user_id].add(skill_id)
+        self.state = ScoringState(
+            user_ids=user_ids, skill_id_to_idx=skill_id_to_idx, skill_features=skill_features,
+            unknown_skill_pred=unknown_skill_pred, user_bits=user_bits, available_idx=available_idx
+        )
 
         logging.info("Recommendation model has been refreshed successfully.")
 
     def get_recommendations(self, skill_ids: List[int], limit: int) -> List[Dict[str, Any]]:
-        if not self.model:
+        # Read the snapshot once, so a concurrent refresh can't swap arrays mid-request
+        state = self.state
+        if state is None:
             return []
 
         required_skills: Set[int] = set(skill_ids)
         if not required_skills:
             return []
 
-        # --- STAGE 1: CANDIDATE GENERATION ---
-        candidate_pool: Set[int] = {
-            user_id for user_id in self.available_user_ids 
-            if not required_skills.isdisjoint(self.user_skills_map.get(user_id, set()))
-        }
-
-        logging.info(f"Stage 1: Generated a pool of {len(candidate_pool)} candidates.")
-
-        # --- STAGE 2 & 3: FEATURE ENGINEERING & RANKING ---
-        recommendations = []
-        for user_id in candidate_pool:
+        skill_idx = lookup_idx(state.skill_id_to_idx, list(required_skills))
 
-            # -- Feature 1: Skill Coverage --
-            matched_skills = required_skills.intersection(self.user_skills_map.get(user_id, set()))
-            if not matched_skills:
-                continue # Should not happen due to pool generation, but as a safeguard.
+        # --- STAGE 1: CANDIDATE GENERATION ---
+        # Available users whose skill bitset overlaps the required skills' bitset
+        req_bits = np.zeros(state.user_bits.shape[1], dtype=np.uint64)
+        np.bitwise_or.at(req_bits, skill_idx // 64, skill_bit(skill_idx))
+        overlap = (state.user_bits[state.available_idx] & req_bits).any(axis=1)
+        cand_idx = state.available_idx[overlap]
+        candidates = state.user_ids[cand_idx]
 
-            skill_coverage_score = len(matched_skills) / len(required_skills)
+        logging.info(f"Stage 1: Generated a pool of {len(candidates)} candidates.")
 
-            # -- Feature 2: Dynamic Proficiency Score --
-            proficiency_scores = [self.actual_ratings_map.get((user_id, skill_id), 0) for skill_id in matched_skills]
-            avg_proficiency_score = sum(proficiency_scores) / len(proficiency_scores) if proficiency_scores else 0
+        if not len(candidates):
+            logging.warning(f"No suitable recommendations found for skill_ids: {list(required_skills)}")
+            return []
 
-            # -- Feature 3: Collaborative Affinity Score --
-            affinity_scores = [self.model.predict(uid=user_id, iid=skill_id).est for skill_id in required_skills]
-            avg_affinity_score = sum(affinity_scores) / len(affinity_scores) if affinity_scores else 0
+        # --- STAGE 2 & 3: FEATURE ENGINEERING & RANKING ---
+        # All features and the final weighted score are computed in one fused pass
+        skill_coverage = np.empty(len(cand_idx))
+        avg_proficiency = np.empty(len(cand_idx))
+        avg_affinity = np.empty(len(cand_idx))
+        final_scores = np.empty(len(cand_idx))
+        score_candidates(
+            cand_idx, skill_idx, len(required_skills),
+            state.skill_features, state.unknown_skill_pred,
+            self.WEIGHT_COVERAGE, self.WEIGHT_PROFICIENCY, self.WEIGHT_AFFINITY,
+            skill_coverage, avg_proficiency, avg_affinity, final_scores
+        )
 
-            # -- Final Weighted Score --
-            final_score = (
-                (self.WEIGHT_COVERAGE * skill_coverage_score) +
-                (self.WEIGHT_PROFICIENCY * (avg_proficiency_score / 5.0)) + # Normalize to 0-1 scale
-                (self.WEIGHT_AFFINITY * (avg_affinity_score / 5.0))   # Normalize to 0-1 scale
-            )
+        # Select the top `limit` by final combined score in O(n), then sort just those
+        k = min(limit, len(candidates))
+        top = np.argpartition(-final_scores, k - 1)[:k]
+        top = top[np.argsort(-final_scores[top], kind='stable')]
 
-            recommendations.append({
-                'user_id': user_id, 
-                'score': final_score,
+        recommendations = [
+            {
+                'user_id': user_id,
+                'score': score,
                 # Optional: return sub-scores for explainability
                 'details': {
-                    'skill_coverage': skill_coverage_score,
-                    'avg_proficiency': avg_proficiency_score,
-                    'affinity_score': avg_affinity_score
+                    'skill_coverage': coverage,
+                    'avg_proficiency': proficiency,
+                    'affinity_score': affinity
                 }
-            })
-
-        # Sort by the final combined score
-        recommendations.sort(key=lambda x: x['score'], reverse=True)
-        if not recommendations:
-            logging.warning(f"No suitable recommendations found for skill_ids: {list(required_skills)}")
-            return []
+            }
+            for user_id, score, coverage, proficiency, affinity in zip(
+                candidates[top].tolist(), final_scores[top].tolist(), skill_coverage[top].tolist(),
+                avg_proficiency[top].tolist(), avg_affinity[top].tolist()
+            )
+        ]
 
         logging.info(f"Top recommendation (user {recommendations[0]['user_id']}) details: {recommendations[0]['details']}")
 
-        return recommendations[:limit]
+        return recommendations
@@ -2,7 +2,6 @@
 
 from dotenv import load_dotenv
 import os
-import psycopg2
 
 # Load env variables
 load_dotenv()
@@ -10,8 +9,11 @@ load_dotenv()
 import logging
 from contextlib import asynccontextmanager
 from fastapi import Depends, FastAPI, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import api_key
+from sqlalchemy import text
 
+from .data_loader import get_db_engine
 from .engine import RecommendationEngine
 from .schemas import RecommendationRequest, RecommendationResponse
 from .security import get_api_key
@@ -25,6 +27,14 @@ lifespan_context = {}
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Code here runs on startup
+    if os.getenv("DATABASE_URL"):
+        # Health probes share the data loader's pooled engine instead of reconnecting each time
+        try:
+            lifespan_context["db_engine"] = get_db_engine()
+        except Exception as e:
+            # Leave db_engine unset so /health reports the database as disconnected
+            logging.critical(f"Database engine creation failed: {e}")
+
     logging.info("Initializing recommendation engine...")
     try:
         lifespan_context["engine"] = RecommendationEngine()
@@ -37,6 +47,9 @@ async def lifespan(app: FastAPI):
     
     # Code here runs on shutdown
     logging.info("Shutting down...")
+    db_engine = lifespan_context.get("db_engine")
+    if db_engine:
+        db_engine.dispose()
     lifespan_context.clear()
 
 
@@ -57,20 +70,18 @@ def health_check():
     and the database connection.
     """
     engine = lifespan_context.get("engine")
-    model_ready = bool(engine and engine.model)
+    model_ready = bool(engine and engine.is_ready)
     db_ok = False
     db_error = "Not checked"
 
     try:
-        db_url = os.getenv("DATABASE_URL")
-        if not db_url:
-            raise ValueError("DATABASE_URL environment variable not set.")
+        db_engine = lifespan_context.get("db_engine")
+        if not db_engine:
+            raise ValueError("Database engine unavailable; check the DATABASE_URL environment variable.")
         
-        # Try to connect to the database
-        conn = psycopg2.connect(db_url)
-        # Run a simple query to ensure the connection is live
-        conn.cursor().execute("SELECT 1")
-        conn.close()
+        # Borrow a pooled connection and run a simple query to ensure it is live
+        with db_engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
         db_ok = True
         db_error = None
 
@@ -108,13 +119,15 @@ async def recommend_engineers(
     recommended engineers.
     """
     engine = lifespan_context.get("engine")
-    if not engine or not engine.model:
+    if not engine or not engine.is_ready:
         raise HTTPException(
             status_code=503, 
             detail="Recommendation engine is not available or failed to initialize."
         )
 
-    recommendations = engine.get_recommendations(
+    # Scoring is CPU-bound, so run it off the event loop to keep other requests responsive
+    recommendations = await run_in_threadpool(
+        engine.get_recommendations,
         skill_ids=request.skill_ids,
         limit=request.limit
     )
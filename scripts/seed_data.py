@@ -1,18 +1,21 @@
 # scripts/seed_data.py
 
 import os
+import io
+import csv
 import sys
 import logging
 import random
 from datetime import datetime, timedelta, timezone
 
 import bcrypt
+import numpy as np
 from dotenv import load_dotenv
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, insert, select, text
 from sqlalchemy.orm import sessionmaker, Session
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-from app.models import Team, User, Skill, Project, Task, UserSkill, TaskRequiredSkill
+from app.models import Team, User, Skill, Project, Task, UserSkill
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 _ = load_dotenv()
@@ -28,6 +31,10 @@ PERSONAS = {
     "sam": {"name": "Sam Jones", "archetype": "T-Shaped DevOps Engineer"},
 }
 
+# Derive each persona's login email once, at import
+for persona in PERSONAS.values():
+    persona["email"] = f"{persona['name'].lower().replace(' ', '.')}@synapse.com"
+
 TASK_TEMPLATES = {
     "Full-Stack Feature": {"skills": ["Python", "React", "PostgreSQL"]},
     "UI Component Build": {"skills": ["React", "TypeScript", "Tailwind CSS"]},
@@ -42,7 +49,6 @@ TASK_TEMPLATES = {
 def clear_data(session: Session):
     logging.info("Clearing existing transactional data...")
     session.execute(text("TRUNCATE TABLE invitations, task_required_skills, user_skills, tasks, projects, users, teams RESTART IDENTITY CASCADE"))
-    session.commit()
     logging.info("Transactional data cleared successfully.")
 
 def seed_data():
@@ -51,90 +57,99 @@ def seed_data():
         logging.error("DATABASE_URL environment variable not set.")
         return
 
-    engine = create_engine(db_url)
-    SessionLocal = sessionmaker(bind=engine)
+    # Let psycopg2 fold each executemany into multi-VALUES pages instead of
+    # one round-trip per row.
+    engine = create_engine(
+        db_url,
+        executemany_mode="values_plus_batch",
+        insertmanyvalues_page_size=1000,
+        executemany_batch_page_size=500,
+    )
+    # The seed is the only writer and gets its ids from RETURNING, never from a flush
+    SessionLocal = sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
     session = SessionLocal()
 
     try:
+        # The whole seed, TRUNCATE included, runs as one transaction. The data is
+        # regeneratable, so skip the WAL fsync on its commit.
+        session.execute(text("SET LOCAL synchronous_commit = OFF"))
         clear_data(session)
 
         # 1. Fetch skills
         logging.info("Fetching existing skills from DB...")
-        all_skills = session.query(Skill).all()
-        skills_map = {skill.skill_name: skill for skill in all_skills}
-        logging.info(f"Loaded {len(skills_map)} skills.")
-
-        # 2. Create Teams
-        logging.info("Seeding teams...")
-        hashed_password = bcrypt.hashpw("password".encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+        skill_id_map = dict(session.execute(select(Skill.skill_name, Skill.id)).all())
+        logging.info(f"Loaded {len(skill_id_map)} skills.")
+        template_skill_ids = {name: tuple(skill_id_map[s] for s in tmpl["skills"])
+                              for name, tmpl in TASK_TEMPLATES.items()}
+
+        # 2. Create Teams and Projects
+        logging.info("Seeding teams and projects...")
+        # Seed accounts are test data, so use bcrypt's minimum cost factor.
+        hashed_password = bcrypt.hashpw("password".encode('utf-8'), bcrypt.gensalt(rounds=4)).decode('utf-8')
         team_names = ["Backend Titans", "Frontend Wizards", "Data Mavericks", "Cloud Sentinels"]
-        teams = {name: Team(team_name=name) for name in team_names}
-        session.add_all(teams.values())
-        session.flush()
+        project_names = ["Project Apollo", "Project Gemini"]
+        # Neither table depends on the other; RETURNING hands back the ids without a flush
+        rows = session.execute(
+            insert(Team).returning(Team.id, Team.team_name),
+            [{"team_name": name} for name in team_names]
+        ).all()
+        team_ids = {name: tid for tid, name in rows}
+        seed_project_ids = session.execute(
+            insert(Project).returning(Project.id, sort_by_parameter_order=True),
+            [{"project_name": name} for name in project_names]
+        ).scalars().all()
 
         # 3. Define Engineer Archetypes
         archetypes = {
-            "Veteran Full-Stack Generalist": {"team": teams["Backend Titans"], "skills": [("Python", "expert"), ("React", "intermediate"), ("PostgreSQL", "expert"), ("Docker", "intermediate")]},
-            "New Frontend Specialist": {"team": teams["Frontend Wizards"], "skills": [("React", "expert"), ("TypeScript", "expert"), ("Tailwind CSS", "expert"), ("Next.js", "intermediate")]},
-            "Pure Backend Specialist": {"team": teams["Backend Titans"], "skills": [("Go", "expert"), ("PostgreSQL", "expert"), ("Docker", "expert"), ("Redis", "intermediate")]},
-            "T-Shaped DevOps Engineer": {"team": teams["Cloud Sentinels"], "skills": [("AWS", "expert"), ("Kubernetes", "expert"), ("Terraform", "expert"), ("Python", "intermediate"), ("CI/CD", "expert")]},
+            "Veteran Full-Stack Generalist": {"team_id": team_ids["Backend Titans"], "skills": [("Python", "expert"), ("React", "intermediate"), ("PostgreSQL", "expert"), ("Docker", "intermediate")]},
+            "New Frontend Specialist": {"team_id": team_ids["Frontend Wizards"], "skills": [("React", "expert"), ("TypeScript", "expert"), ("Tailwind CSS", "expert"), ("Next.js", "intermediate")]},
+            "Pure Backend Specialist": {"team_id": team_ids["Backend Titans"], "skills": [("Go", "expert"), ("PostgreSQL", "expert"), ("Docker", "expert"), ("Redis", "intermediate")]},
+            "T-Shaped DevOps Engineer": {"team_id": team_ids["Cloud Sentinels"], "skills": [("AWS", "expert"), ("Kubernetes", "expert"), ("Terraform", "expert"), ("Python", "intermediate"), ("CI/CD", "expert")]},
         }
 
         # 4. Seed Specific Personas
         logging.info("--- Seeding Specific Test Personas ---")
+        user_rows = []
+        user_skill_specs = [] # (user name, skill name, proficiency), resolved to ids after insert
         for key, persona_info in PERSONAS.items():
             archetype_name = persona_info["archetype"]
             archetype_config = archetypes[archetype_name]
-            user = User(
-                name=persona_info["name"],
-                email=f"{persona_info['name'].lower().replace(' ', '.')}@synapse.com",
-                password_hash=hashed_password, role='engineer', team=archetype_config["team"]
-            )
-            session.add(user)
-            logging.info(f"Created Persona: {user.name} ({archetype_name})")
-            
+            user_rows.append({
+                "name": persona_info["name"],
+                "email": persona_info["email"],
+                "password_hash": hashed_password, "role": 'engineer', "team_id": archetype_config["team_id"]
+            })
+            logging.info(f"Created Persona: {persona_info['name']} ({archetype_name})")
+
             for skill_name, prof in archetype_config["skills"]:
-                session.add(UserSkill(user=user, skill=skills_map[skill_name], proficiency=prof))
-        session.commit()
+                user_skill_specs.append((persona_info["name"], skill_name, prof))
 
         # 5. Seed a large number of other engineers for model training data
         logging.info("--- Seeding Additional Engineers for Data Richness ---")
-        used_emails = set(p[0] for p in session.query(User.email).all())
-
         NUM_EXTRA_ENGINEERS = 40
-        generated_count = 0
-        max_attempts = NUM_EXTRA_ENGINEERS * 5
-
-        for i in range(max_attempts):
-            if generated_count >= NUM_EXTRA_ENGINEERS:
-                break
-            
-            rand_num = random.randint(100, 9999)
+        archetype_names = tuple(archetypes.keys())
+
+        # Sampling without replacement guarantees unique numbers, and persona emails
+        # are name-based so they can never collide with user.{N}
+        for rand_num in random.sample(range(100, 10000), NUM_EXTRA_ENGINEERS):
             email = f"user.{rand_num}@synapse.com"
-            if email in used_emails:
-                continue
-            
-            archetype_name = random.choice(list(archetypes.keys()))
+            archetype_name = random.choice(archetype_names)
             config = archetypes[archetype_name]
-            user = User(name=f"User-{rand_num}", email=email, password_hash=hashed_password, role='engineer', team=config["team"])
-            session.add(user)
-            session.flush()
+            user_name = f"User-{rand_num}"
+            user_rows.append({"name": user_name, "email": email, "password_hash": hashed_password, "role": 'engineer', "team_id": config["team_id"]})
 
             for skill, prof in config["skills"]:
-                session.add(UserSkill(user=user, skill=skills_map[skill], proficiency=prof))
-
-            used_emails.add(email)
-            generated_count += 1
-        
-        session.commit()
+                user_skill_specs.append((user_name, skill, prof))
+
+        # Insert all users in one executemany, getting their generated ids back via RETURNING
+        user_ids = dict(session.execute(insert(User).returning(User.name, User.id), user_rows).all())
+        session.execute(insert(UserSkill), [
+            {"user_id": user_ids[user_name], "skill_id": skill_id_map[skill_name], "proficiency": prof}
+            for user_name, skill_name, prof in user_skill_specs
+        ])
         
-        # 6. Seed Projects and a Realistic Task History
+        # 6. Seed a Realistic Task History
         logging.info("--- Seeding Realistic Task History for Personas ---")
-        proj_apollo = Project(project_name="Project Apollo")
-        proj_gemini = Project(project_name="Project Gemini")
-        session.add_all([proj_apollo, proj_gemini])
-        session.flush()
-
         task_assignments = [
             {"assignee_name": "Priya Patel", "template": "Full-Stack Feature", "count": 25},
             {"assignee_name": "Leo Chen", "template": "UI Component Build", "count": 2},
@@ -143,23 +158,47 @@ def seed_data():
             {"assignee_name": "Sam Jones", "template": "CI/CD Scripting", "count": 4},
         ]
 
+        task_rows = []
+        task_skill_ids = [] # The required skill ids of each row in task_rows
+        now = datetime.now(timezone.utc)
+        # Draw every task's completion offset and project up front, as plain ints for the driver
+        total_tasks = sum(a["count"] for a in task_assignments)
+        day_offsets = np.random.randint(5, 101, size=total_tasks).tolist()
+        project_ids = np.random.choice(seed_project_ids, size=total_tasks).tolist()
         for assignment in task_assignments:
             user_name = assignment["assignee_name"]
-            user = session.query(User).filter_by(name=user_name).one()
-            
-            template = TASK_TEMPLATES[assignment["template"]]
-            logging.info(f"Assigning {assignment['count']} '{assignment['template']}' tasks to {user.name}...")
+            assignee_id = user_ids[user_name] # Returned by the user insert, no lookup query needed
+
+            skill_ids = template_skill_ids[assignment["template"]]
+            logging.info(f"Assigning {assignment['count']} '{assignment['template']}' tasks to {user_name}...")
 
             for i in range(assignment["count"]):
-                task = Task(
-                    project_id=random.choice([proj_apollo.id, proj_gemini.id]),
-                    title=f"{assignment['template']} Task #{i+1}",
-                    status='done', assignee_id=user.id,
-                    completed_at=datetime.now(timezone.utc) - timedelta(days=random.randint(5, 100))
-                )
-                session.add(task)
-                for skill_name in template["skills"]:
-                    session.add(TaskRequiredSkill(task=task, skill=skills_map[skill_name]))
+                k = len(task_rows)
+                task_rows.append({
+                    "project_id": project_ids[k],
+                    "title": f"{assignment['template']} Task #{i+1}",
+                    "status": 'done', "assignee_id": assignee_id,
+                    "completed_at": now - timedelta(days=day_offsets[k])
+                })
+                task_skill_ids.append(skill_ids)
+
+        # RETURNING in parameter order lines each generated task id up with its skill ids
+        # Tasks are never read back through the session, so skip the ORM and use Core
+        conn = session.connection()
+        task_table = Task.__table__
+        task_ids = conn.execute(
+            task_table.insert().returning(task_table.c.id, sort_by_parameter_order=True), task_rows
+        ).scalars().all()
+        # task_required_skills is the largest child table, so stream it in with COPY
+        buf = io.StringIO()
+        csv.writer(buf).writerows(
+            (task_id, skill_id)
+            for task_id, skill_ids in zip(task_ids, task_skill_ids)
+            for skill_id in skill_ids
+        )
+        buf.seek(0)
+        with conn.connection.cursor() as cursor:
+            cursor.copy_expert("COPY task_required_skills (task_id, skill_id) FROM STDIN WITH CSV", buf)
 
         session.commit()
         logging.info("Seeding complete. Database contains a realistic, testable dataset.")